@@ -0,0 +1,84 @@
+import argparse
+import numpy as np
+
+import ensemble
+
+# Adaptive number of iterations
+#
+# Rosenstein: the neighbour search is done once, in numpy (the same search as the ensemble mode), for all the points
+# which can be followed for the whole --iterations. The divergence curve is then extended one step at a time, every
+# step only follows the pairs one step further. It stops once the linear region has ended well before the current
+# length of the curve, the last steps have saturated (they rise at less than SATURATION of the rate of the linear
+# region) and the slope over the linear region moved by less than the tolerance with the last step. Stopping early
+# saves the tail of the curve, the search itself is always done in full.
+#
+# Sano-Sawada: the estimator always runs for the whole number of iterations it is constructed with, so it is rerun
+# on a doubling schedule of iteration counts instead (1/8, 1/4, 1/2 of the maximum and so on) until the spectrum
+# agrees with the previous one within the tolerance. The last count of the schedule is always the one passed on the
+# command line. Every rerun starts from scratch: converging at 1/4 of the maximum costs 3/8 of a full run, not
+# converging at all costs about twice as much, which is why the mode is off unless asked for.
+#
+# Kantz is not offered: its divergence averages over every pair within the neighbourhood radii, not over a single
+# nearest neighbour per point, so those pairs cannot be kept from one search and each step would need another pass
+# over all the pairwise distances, the cost the adaptive mode is meant to save.
+
+# Linear region counts as captured once the curve extends this many steps past its end, and these steps rise at
+# less than this share of its rate
+MARGIN = 6
+SATURATION = 0.25
+
+
+def divergence(series, e_dim, tau, iterations, tol=None, window=0, eps_min=0.0, correlation_radii=0):
+    # Correlation sum, when asked for, is counted in the same neighbour search
+    cloud, position, neighbour_position, _, correlation_sum = ensemble.pairs([series], e_dim, tau, iterations,
+                                                                             window, eps_min, correlation_radii)
+    if tol is None:
+        steps = np.arange(iterations + 1)
+        return np.nanmean(ensemble.log_separation(cloud, position, neighbour_position, steps), axis=0), correlation_sum
+
+    curve = np.empty(iterations + 1)
+    previous = None
+    for step in range(iterations + 1):
+        curve[step] = np.nanmean(ensemble.log_separation(cloud, position, neighbour_position, np.array([step])))
+
+        end = ensemble.linear_end(curve[:step + 1])
+        slope = ensemble.slope(curve[:step + 1])
+        if end + MARGIN <= step + 1 and end >= 2 and previous is not None and abs(slope - previous) <= tol:
+            rate = (curve[end - 1] - curve[0]) / (end - 1)
+            if abs(curve[step] - curve[step - MARGIN]) / MARGIN <= SATURATION * abs(rate):
+                return curve[:step + 1], correlation_sum
+        previous = slope
+
+    return curve, correlation_sum
+
+
+def with_iterations(args, iterations):
+    return argparse.Namespace(**{**vars(args), 'iterations': iterations})
+
+
+def schedule(iterations, length=None):
+    # length only stands in for the bound when iterations has a special meaning (0 for all points)
+    bound = iterations or length
+    count = max(1, bound // 8)
+    while count < bound:
+        yield count
+        count *= 2
+    yield iterations
+
+
+def spectrum_converged(previous, current, tol):
+    _, previous_spectrum = previous
+    _, spectrum = current
+    return max(abs(a - b) for a, b in zip(spectrum, previous_spectrum)) <= tol
+
+
+def run(calculate, series, args, tol, converged, length=None):
+    # Returns the result, the arguments it was computed with and the number of iterations they stand for
+    previous = None
+    for iterations in schedule(args.iterations, length):
+        current = calculate(series, with_iterations(args, iterations))
+        if previous is not None and converged(previous, current, tol):
+            break
+        previous = current
+
+    return current, with_iterations(args, iterations), iterations or length
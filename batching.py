@@ -1,20 +1,41 @@
 import os
 import time
+import threading
 import subprocess
 from concurrent.futures import ThreadPoolExecutor
 import glob
 import argparse
 
+import series_io
+import shared_series
+from metrics import Metrics
+
 N_WORKERS = 4
 
 
 class Batcher:
-    def __init__(self, folder, what, arguments):
+    def __init__(self, folder, what, arguments, shared=False, workers=N_WORKERS, metrics_port=None, metrics_file=None):
         self.folder = folder
         self.what = what
         self.arguments = arguments
+        self.shared = shared
+        self.workers = workers
+        self.metrics_port = metrics_port
+        self.metrics_file = metrics_file
         self.futures = set()
-        self.file_names = [f for f in glob.glob(f"{self.folder}/*.txt")]
+        # Compressed files and archive members are handed to the workers as they are, without extracting them.
+        # Tar members are not random-access, so a tar archive goes to a single worker which streams through it.
+        file_names = [f for f in glob.glob(f"{self.folder}/*") if os.path.isfile(f) and series_io.matches(f, ".txt")]
+        self.file_names = series_io.expand(file_names, ".txt")
+        # Every script runs with every set of arguments on a file before the next file is started
+        self.jobs = [(file_name, what, arguments)
+                     for file_name in self.file_names for what in self.what for arguments in self.arguments]
+        self.blocks = {}
+        self.loading = {}
+        self.loader = None
+        self.unshared = set()
+        self.lock = threading.Lock()
+        self.metrics = Metrics(self.jobs, lambda: len(self.jobs))
 
     def push(self, future):
         self.futures.add(future)
@@ -23,36 +44,106 @@ class Batcher:
         self.futures.remove(future)
 
     def wait(self):
-        while len(self.futures) >= N_WORKERS:
+        while len(self.futures) >= self.workers:
             time.sleep(0.1)
 
     def next(self):
-        return self.file_names.pop(0)
+        return self.jobs.pop(0)
+
+    def load(self, file_name):
+        try:
+            return shared_series.load(file_name)
+        except Exception as e:
+            # Workers of this file read it on their own and fail (or not) by themselves
+            print(f'Could not share {file_name}: {e}')
+            return None
+
+    def prefetch(self, file_name):
+        if file_name not in self.loading:
+            self.loading[file_name] = self.loader.submit(self.load, file_name)
+
+    def acquire(self, file_name):
+        # File is parsed once into shared memory and kept there until its last job is done. Parsing runs on the
+        # loader thread, the next file is parsed while the jobs of this one run, and the lock is only held to
+        # register the block, so that workers releasing theirs are never kept waiting for a parse
+        if file_name in self.unshared:
+            return None
+
+        with self.lock:
+            if file_name in self.blocks:
+                return self.blocks[file_name][1]
+
+        self.prefetch(file_name)
+        upcoming = next((job[0] for job in self.jobs if job[0] != file_name and not series_io.is_tar(job[0])), None)
+        if upcoming is not None:
+            self.prefetch(upcoming)
+
+        loaded = self.loading.pop(file_name).result()
+        if loaded is None:
+            self.unshared.add(file_name)
+            return None
+
+        shm, handle = loaded
+        pending = sum(1 for job in self.jobs if job[0] == file_name) + 1
+        with self.lock:
+            self.blocks[file_name] = [shm, handle, pending]
+
+        return handle
+
+    def release(self, file_name):
+        with self.lock:
+            block = self.blocks[file_name]
+            block[2] -= 1
+            if block[2] == 0:
+                shared_series.release(block[0])
+                del self.blocks[file_name]
 
     def runnable(self, what, arguments):
-        def _runnable(file_name):
-            p = subprocess.Popen(
-                f'.\\venv\\Scripts\\activate && py {what} -f "{file_name}" {arguments}', shell=True)
-            p.wait()
+        def _runnable(file_name, handle=None):
+            shared = f' -H "{handle}"' if handle else ''
+            self.metrics.start(file_name, what)
+            returncode = None
+            try:
+                p = subprocess.Popen(
+                    f'.\\venv\\Scripts\\activate && py {what} -f "{file_name}" {arguments}{shared}', shell=True)
+                returncode = p.wait()
+            finally:
+                self.metrics.finish(returncode)
+
+                if handle:
+                    self.release(file_name)
 
         return _runnable
 
     def run(self):
-        executor = ThreadPoolExecutor(max_workers=N_WORKERS)
+        executor = ThreadPoolExecutor(max_workers=self.workers)
+        self.loader = ThreadPoolExecutor(max_workers=1)
+
+        if self.metrics_port is not None:
+            self.metrics.serve(self.metrics_port)
+        if self.metrics_file is not None:
+            self.metrics.watch(self.metrics_file)
 
         while True:
             self.wait()
 
-            if len(self.file_names) == 0:
+            if len(self.jobs) == 0:
                 break
 
+            file_name, what, arguments = self.next()
+            handle = self.acquire(file_name) if self.shared and not series_io.is_tar(file_name) else None
+
             future = executor.submit(self.runnable(
-                self.what, self.arguments), self.next())
+                what, arguments), file_name, handle)
             future.add_done_callback(self.pop)
 
             self.push(future)
 
         executor.shutdown(wait=True, cancel_futures=False)
+        self.loader.shutdown(wait=True)
+
+        if self.metrics_file is not None:
+            self.metrics.write(self.metrics_file)
 
 
 if __name__ == '__main__':
@@ -66,13 +157,32 @@ if __name__ == '__main__':
     )
     parser.add_argument(
         '-w', '--what',
-        type=str, help='What to batch',
-        default=""
+        type=str, nargs='+', help='What to batch',
+        default=[]
     )
     parser.add_argument(
         '-a', '--arguments',
-        type=str, help='Arguments to forward to python file',
-        default=""
+        type=str, nargs='+', help='Arguments to forward to python file',
+        default=[""]
+    )
+    parser.add_argument(
+        '-s', '--shared',
+        action='store_true', help='Load every file once and share it with the workers'
+    )
+    parser.add_argument(
+        '-n', '--workers',
+        type=int, help='Number of jobs run at once',
+        default=N_WORKERS
+    )
+    parser.add_argument(
+        '-p', '--metrics_port',
+        type=int, help='Local port serving the progress metrics as JSON',
+        default=None
+    )
+    parser.add_argument(
+        '-m', '--metrics_file',
+        type=str, help='File the progress metrics are periodically written to',
+        default=None
     )
 
     args = parser.parse_args()
@@ -80,7 +190,8 @@ if __name__ == '__main__':
     if len(args.folder) == 0:
         raise Exception('Pass a folder!')
 
-    if len(args.what) == 0 or not args.what.endswith(".py"):
+    if len(args.what) == 0 or not all(what.endswith(".py") for what in args.what):
         raise Exception('Pass a python file!')
 
-    Batcher(args.folder, args.what, args.arguments).run()
+    Batcher(args.folder, args.what, args.arguments, args.shared,
+            args.workers, args.metrics_port, args.metrics_file).run()
@@ -0,0 +1,55 @@
+import numpy as np
+
+import embedding
+import neighbours
+
+# Correlation sum and correlation dimension (Grassberger-Procaccia)
+#
+# The correlation sum C(r) is the fraction of pairs of reconstructed points closer than r. It is counted for all
+# the radii of a logarithmic grid at once, in a single pass over the blocks of pairwise distances, with the same
+# Theiler window as the exponent estimators. The correlation dimension is the slope of log C(r) over log r in the
+# scaling region, taken where C(r) lies between LOW and HIGH. It is NaN when the scaling region holds fewer than two
+# radii (the grid is too coarse, or the series too short) and for a series without any extent (constant series).
+
+LOW = 1e-3
+HIGH = 1e-1
+
+
+def radii(points, count, ratio=1e-3):
+    diameter = np.linalg.norm(points.max(axis=0) - points.min(axis=0))
+    if not diameter > 0:
+        return np.empty(0)
+
+    return np.geomspace(diameter * ratio, diameter, count)
+
+
+def correlation_sum(points, radii, groups=None, indices=None, window=0):
+    counts, pairs = 0, 0
+    for _, _, distances in neighbours.distance_blocks(points, groups, indices, window):
+        block_counts, block_pairs = neighbours.count_pairs(distances, radii)
+        counts, pairs = counts + block_counts, pairs + block_pairs
+
+    return np.cumsum(counts)[:-1] / max(pairs, 1)
+
+
+def dimension(radii, sums, low=LOW, high=HIGH):
+    # No fallback to the whole curve, the saturated plateau would bias the dimension towards 0
+    scaling = (sums >= low) & (sums <= high)
+    if np.count_nonzero(scaling) < 2:
+        return float('nan')
+
+    return float(np.polyfit(np.log(radii[scaling]), np.log(sums[scaling]), 1)[0])
+
+
+def calculate(series, e_dim, tau, count, window=0):
+    points = embedding.embed(series, e_dim, tau)
+    grid = radii(points, count)
+    sums = correlation_sum(points, grid, window=window)
+
+    return dimension(grid, sums), grid, sums
+
+
+def write_report(path, result, grid, sums):
+    with open(path, 'w') as f:
+        f.write(f'{result}\n')
+        f.write('\n'.join(f'{r} {c}' for r, c in zip(grid, sums)))
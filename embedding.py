@@ -0,0 +1,131 @@
+import numpy as np
+
+import neighbours
+
+# Estimation of the phase space reconstruction parameters
+#
+# tau                     Picked either from the first local minimum of the average mutual information ('mi'),
+#                         computed from a joint histogram of the series and its lagged copy, or from the first lag
+#                         at which the autocorrelation decays below 1/e ('acf').
+#
+# e_dim                   Picked from the false nearest neighbours: the smallest dimension in which the fraction of
+#                         false neighbours falls below a threshold. The pairwise distances are shared across the
+#                         candidate dimensions, each dimension only adds its own coordinate to them.
+
+TAU_METHODS = ('mi', 'acf')
+
+
+def embed(series, e_dim, tau):
+    series = np.asarray(series, dtype=float)
+    count = series.shape[0] - (e_dim - 1) * tau
+    if count <= 0:
+        raise Exception('Series is too short for the embedding!')
+
+    return np.stack([series[k * tau:k * tau + count] for k in range(e_dim)], axis=1)
+
+
+def mutual_information(series, max_lag, bins=16):
+    series = np.asarray(series, dtype=float)
+    length = series.shape[0]
+
+    # Series is binned once, every lag only re-counts the pairs of symbols
+    edges = np.histogram_bin_edges(series, bins)
+    symbols = np.digitize(series, edges[1:-1])
+
+    information = np.empty(max_lag + 1)
+    for lag in range(max_lag + 1):
+        joint = np.bincount(symbols[:length - lag] * bins + symbols[lag:],
+                            minlength=bins * bins).reshape(bins, bins) / (length - lag)
+        marginals = np.outer(joint.sum(axis=1), joint.sum(axis=0))
+
+        nonzero = joint > 0
+        information[lag] = np.sum(joint[nonzero] * np.log(joint[nonzero] / marginals[nonzero]))
+
+    return information
+
+
+def autocorrelation(series, max_lag):
+    series = np.asarray(series, dtype=float)
+    length = series.shape[0]
+    centered = series - series.mean()
+
+    size = 1 << int(np.ceil(np.log2(2 * length - 1)))
+    spectrum = np.fft.rfft(centered, n=size)
+    correlation = np.fft.irfft(spectrum * np.conj(spectrum), n=size)[:max_lag + 1]
+
+    return correlation / correlation[0]
+
+
+def estimate_tau(series, method='mi', max_lag=100, bins=16):
+    max_lag = min(max_lag, np.asarray(series).shape[0] - 2)
+
+    if method == 'mi':
+        information = mutual_information(series, max_lag, bins)
+        minima = np.flatnonzero((information[1:-1] < information[:-2]) & (information[1:-1] <= information[2:]))
+        if minima.size > 0:
+            return int(minima[0] + 1)
+        return int(np.argmin(information[1:]) + 1)
+
+    if method == 'acf':
+        correlation = autocorrelation(series, max_lag)
+        below = np.flatnonzero(correlation[1:] < 1 / np.e)
+        if below.size > 0:
+            return int(below[0] + 1)
+        return max_lag
+
+    raise Exception(f'Unknown tau estimation method: {method}!')
+
+
+def false_nearest_neighbours(series, tau, max_dim=10, rtol=15.0, atol=2.0, window=0):
+    series = np.asarray(series, dtype=float)
+
+    # Same set of points for every dimension, so that one neighbour search serves all of them
+    count = series.shape[0] - max_dim * tau
+    if count <= window + 1:
+        raise Exception('Series is too short for the false nearest neighbours!')
+
+    sigma = series.std()
+    groups = np.zeros(count, dtype=np.int64)
+    indices = np.arange(count)
+
+    # Same blocks and Theiler exclusion as neighbours.distance_blocks, but the squared distances are kept and
+    # grown by one coordinate per dimension instead of being recomputed for every dimension
+    false_counts = np.zeros(max_dim, dtype=np.int64)
+    for start, stop in neighbours.chunks(count):
+        rows = indices[start:stop]
+        excluded = neighbours.excluded(start, stop, groups, indices, window)
+        distances = np.zeros((rows.shape[0], count))
+
+        for d in range(1, max_dim + 1):
+            coordinate = series[(d - 1) * tau:(d - 1) * tau + count]
+            distances += (coordinate[rows, None] - coordinate[None, :]) ** 2
+
+            masked = np.where(excluded, np.inf, distances)
+            nearest = np.argmin(masked, axis=1)
+            nearest_distance = np.sqrt(masked[np.arange(rows.shape[0]), nearest])
+
+            following = series[d * tau:d * tau + count]
+            gap = np.abs(following[rows] - following[nearest])
+
+            false = (gap > rtol * nearest_distance) | (np.hypot(nearest_distance, gap) > atol * sigma)
+            false_counts[d - 1] += np.count_nonzero(false)
+
+    return false_counts / count
+
+
+def estimate_e_dim(series, tau, max_dim=10, threshold=0.05, window=0):
+    fractions = false_nearest_neighbours(series, tau, max_dim, window=window)
+
+    below = np.flatnonzero(fractions <= threshold)
+    if below.size > 0:
+        return int(below[0] + 1)
+    return int(np.argmin(fractions) + 1)
+
+
+def estimate(series, tau, e_dim, tau_method=None, fnn=False, max_lag=100, max_dim=10, window=0):
+    if tau_method:
+        tau = estimate_tau(series, tau_method, max_lag)
+    if fnn:
+        e_dim = estimate_e_dim(series, tau, max_dim, window=window)
+
+    return tau, e_dim
@@ -0,0 +1,96 @@
+import math
+import numpy as np
+
+import correlation
+import embedding
+import neighbours
+
+# Largest lyapunov exponent of an ensemble of short series of the same system (Rosenstein's algorithm)
+#
+# Every series is embedded on its own and the points are pooled into a single cloud, so that the nearest
+# neighbour of a point may come from any series of the group. The pooled neighbour search is done once for the
+# whole group. Points and their neighbours are only followed within their own series, so no trajectory crosses
+# the boundary between two series. The divergence curve is the mean log distance over the pooled pairs, the
+# contribution of a series is the same curve over the pairs whose reference point comes from that series.
+#
+# When a number of radii is given, the correlation sum of the pooled reference points is counted in the same
+# neighbour pass.
+
+
+def pairs(series_list, e_dim, tau, iterations, window=0, eps_min=0.0, correlation_radii=0):
+    # Reference points and their nearest neighbours as positions in the concatenated clouds, from where they are
+    # followed in time
+    clouds = [embedding.embed(series, e_dim, tau) for series in series_list]
+
+    # Only points which can still be followed for the given number of iterations take part in the search
+    counts = np.array([max(0, cloud.shape[0] - iterations) for cloud in clouds])
+    if counts.sum() < 2:
+        raise Exception('Series are too short for the number of iterations!')
+
+    groups = np.repeat(np.arange(len(clouds)), counts)
+    indices = np.concatenate([np.arange(count) for count in counts])
+    points = np.concatenate([cloud[:count] for cloud, count in zip(clouds, counts)])
+
+    grid = correlation.radii(points, correlation_radii) if correlation_radii > 0 else None
+    nearest, distance, sums = neighbours.search(points, groups, indices, window, eps_min, grid)
+    found = np.isfinite(distance)
+
+    cloud = np.concatenate(clouds)
+    offsets = np.concatenate([[0], np.cumsum([c.shape[0] for c in clouds])[:-1]])
+    position = offsets[groups] + indices
+
+    return cloud, position[found], position[nearest[found]], groups[found], \
+        (grid, sums) if grid is not None else None
+
+
+def log_separation(cloud, position, neighbour_position, steps):
+    separation = np.linalg.norm(cloud[position[:, None] + steps] - cloud[neighbour_position[:, None] + steps], axis=-1)
+    with np.errstate(divide='ignore'):
+        logarithm = np.log(separation)
+    logarithm[~np.isfinite(logarithm)] = np.nan
+
+    return logarithm
+
+
+def divergence(series_list, e_dim, tau, iterations, window=0, eps_min=0.0, correlation_radii=0):
+    cloud, position, neighbour_position, groups, correlation_sum = pairs(series_list, e_dim, tau, iterations,
+                                                                          window, eps_min, correlation_radii)
+    logarithm = log_separation(cloud, position, neighbour_position, np.arange(iterations + 1))
+
+    curve = np.nanmean(logarithm, axis=0)
+    contributions = []
+    for group in range(len(series_list)):
+        selected = groups == group
+        if np.any(selected):
+            contributions.append((np.nanmean(logarithm[selected], axis=0), int(np.count_nonzero(selected))))
+        else:
+            contributions.append((None, 0))
+
+    return curve, contributions, correlation_sum
+
+
+def linear_end(curve, step=3):
+    # Length of the linear region, the same kind of cut the single series scripts make with
+    # SlopeChangePointIndex(slope, 3, amplitude / 30): the curve ends where its increment over step points departs
+    # from the mean slope so far by more than 1/30 of its amplitude
+    finite = np.isfinite(curve)
+    length = curve.shape[0] if finite.all() else int(np.argmin(finite))
+    if length <= 2 * step:
+        return length
+
+    tolerance = (curve[:length].max() - curve[:length].min()) / 30
+    for k in range(step, length - step):
+        mean = (curve[k] - curve[0]) / k * step
+        if abs(curve[k + step] - curve[k] - mean) > tolerance:
+            return k + 1
+
+    return length
+
+
+def slope(curve):
+    # Same measure as the single series scripts take over the linear region of the divergence curve
+    end = linear_end(curve)
+    if end < 2:
+        return float('nan')
+
+    return math.atan2(curve[end - 1] - curve[0], end - 1)
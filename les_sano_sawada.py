@@ -1,7 +1,5 @@
-from pathlib import Path
 import os
 import argparse
-import numpy as np
 
 from pythonnet import load
 load("coreclr")
@@ -11,6 +9,12 @@ import clr
 clr.AddReference("ChaosSoft")
 from ChaosSoft.NumericalMethods.Lyapunov import LeSpecSanoSawada
 
+import adaptive
+import embedding
+import series_io
+import shared_series
+import surrogates
+
 # Description of arguments
 #
 # -d / --e_dim            Embedding dimension used for phase space reconstruction. This is an integer value that
@@ -48,6 +52,46 @@ from ChaosSoft.NumericalMethods.Lyapunov import LeSpecSanoSawada
 #
 # -p / --xstop            Stop row index (exclusive) of the time series in the file. This integer specifies
 #                         the row number at which to stop reading the time series data (not inclusive).
+#
+# -H / --shared           Handle of a shared memory block holding the already parsed --file, passed by batching.py.
+#                         Rows and column are sliced out of the block instead of parsing the file again.
+#
+# =========================================================================================================
+#
+# -S / --surrogates       Number of surrogate series to test the largest exponent against. When positive, the estimator is
+#                         also run on that many surrogates of the series and the p-value is written to the 'surrogates'
+#                         subfolder of the output folder (original result, p-value, then one surrogate result per line).
+#
+# -K / --surrogate_kind   Kind of surrogates: 'ft' (phase randomised) or 'iaaft' (amplitude adjusted).
+#
+# -R / --seed             Seed of the random generator used for the surrogates.
+#
+# -W / --workers          Number of threads the original series and its surrogates are processed with.
+#
+# -T / --auto_tau         Estimates the time lag of every series instead of using --tau: 'mi' for the first minimum of
+#                         the average mutual information, 'acf' for the 1/e decay of the autocorrelation.
+#
+# -D / --auto_e_dim       Estimates the embedding dimension of every series from the false nearest neighbours
+#                         instead of using --e_dim.
+#
+# -L / --max_lag          Largest time lag considered by --auto_tau.
+#
+# -M / --max_dim          Largest embedding dimension considered by --auto_e_dim.
+#
+# -A / --adaptive         Convergence tolerance of the adaptive mode. When given, the number of iterations is grown
+#                         from a fraction of --iterations (of the series length when it is 0) until the spectrum changes
+#                         by less than the tolerance, and the number of iterations actually used is reported (the series
+#                         length minus the embedding when --iterations is 0). Off by default: every step reruns the
+#                         estimator from scratch, so a series which does not converge costs about twice as much.
+
+
+def calculate(series, args):
+    lesss = LeSpecSanoSawada(int(args.e_dim), int(args.tau), int(args.iterations), float(
+        args.eps_min), float(args.eps_step), int(args.min_neighbors), False)
+    lesss.Calculate(series)
+
+    return lesss, list(lesss.Result)
+
 
 # py main.py -f "D:\Projects\TsaToolbox\ff985070-a967-41ce-9922-f3cd8cfd9d8d.txt" -c 2 -a 32000 -p 42000 -d 4 -t 4
 if __name__ == '__main__':
@@ -122,6 +166,58 @@ if __name__ == '__main__':
         type=int, help='Stop row index (exclusive) of the time series in the file',
         default=None
     )
+    parser.add_argument(
+        '-H', '--shared',
+        type=str, help='Shared memory handle of the parsed time series file',
+        default=None
+    )
+
+    parser.add_argument(
+        '-S', '--surrogates',
+        type=int, help='Number of surrogates for significance testing',
+        default=0
+    )
+    parser.add_argument(
+        '-K', '--surrogate_kind',
+        type=str, help='Kind of surrogates',
+        choices=surrogates.KINDS, default='iaaft'
+    )
+    parser.add_argument(
+        '-R', '--seed',
+        type=int, help='Seed for surrogate generation',
+        default=None
+    )
+    parser.add_argument(
+        '-W', '--workers',
+        type=int, help='Number of threads for surrogate testing',
+        default=None
+    )
+
+    parser.add_argument(
+        '-T', '--auto_tau',
+        type=str, help='Method for estimating the time lag',
+        choices=embedding.TAU_METHODS, default=None
+    )
+    parser.add_argument(
+        '-D', '--auto_e_dim',
+        action='store_true', help='Estimate the embedding dimension'
+    )
+    parser.add_argument(
+        '-L', '--max_lag',
+        type=int, help='Largest time lag for estimation',
+        default=100
+    )
+    parser.add_argument(
+        '-M', '--max_dim',
+        type=int, help='Largest embedding dimension for estimation',
+        default=10
+    )
+
+    parser.add_argument(
+        '-A', '--adaptive',
+        type=float, help='Convergence tolerance for adaptive iterations (off by default, can double the cost)',
+        default=None
+    )
 
     args = parser.parse_args()
 
@@ -132,12 +228,12 @@ if __name__ == '__main__':
     file, extension, folder = args.file, args.extension, args.folder
     start, stop = args.xstart, args.xstop
     if folder and os.path.exists(folder):
-        if file and os.path.exists(file_path := os.path.join(folder, file)):
-            if os.path.isfile(file_path):
+        if file and series_io.isfile(file_path := os.path.join(folder, file)):
+            if series_io.isfile(file_path):
                 if not extension:
                     file_paths.append(file_path)
                 else:
-                    if Path(file_path).suffix == extension:
+                    if series_io.matches(file_path, extension):
                         file_paths.append(file_path)
         else:
             for file_entry in os.scandir(folder):
@@ -146,38 +242,62 @@ if __name__ == '__main__':
                     if not extension:
                         file_paths.append(file_path)
                     else:
-                        if Path(file_path).suffix == extension:
+                        if series_io.matches(file_path, extension):
                             file_paths.append(file_path)
     else:
-        if file and os.path.exists(file) and os.path.isfile(file):
+        if file and series_io.isfile(file):
             if not extension:
                 file_paths.append(file)
             else:
-                if Path(file).suffix == extension:
+                if series_io.matches(file, extension):
                     file_paths.append(file)
 
+    file_paths = series_io.expand(file_paths, extension)
+
     if len(file_paths) == 0:
         raise Exception('No file found!')
 
-    for file_path in file_paths:
-        data = np.loadtxt(file_path)
-        start = args.xstart
-        stop = args.xstop
-        series = data[start:stop, args.column]
+    if args.shared:
+        shm, data = shared_series.attach(args.shared)
+        loaded = ((file_path, data[args.xstart:args.xstop, args.column]) for file_path in file_paths)
+    else:
+        loaded = series_io.iterate(file_paths, args.column, args.xstart, args.xstop, extension)
+
+    for file_path, series in loaded:
+        if args.auto_tau or args.auto_e_dim:
+            args.tau, args.e_dim = embedding.estimate(series, args.tau, args.e_dim, args.auto_tau, args.auto_e_dim,
+                                                      args.max_lag, args.max_dim, 0)
+            print(f'tau: {args.tau}, e_dim: {args.e_dim}')
 
-        lesss = LeSpecSanoSawada(int(args.e_dim), int(args.tau), int(args.iterations), float(
-            args.eps_min), float(args.eps_step), int(args.min_neighbors), False)
-        lesss.Calculate(series)
+        if args.adaptive is not None:
+            (lesss, result), used_args, iterations = adaptive.run(calculate, series, args, args.adaptive,
+                                                                  adaptive.spectrum_converged,
+                                                                  len(series) - (args.e_dim - 1) * args.tau)
+            print(f'iterations: {iterations}')
+        else:
+            lesss, result = calculate(series, args)
+            used_args = args
 
         print(lesss.ToString())
         print(lesss.GetResultAsString())
 
-        stem = Path(file_path).stem
-        dirname = os.path.dirname(file_path)
+        stem = series_io.stem(file_path)
+        dirname = series_io.dirname(file_path)
         new_file_name = f'{stem}.txt'
-        output_dir = os.path.join(dirname, args.output)
+        output_dir = os.path.join(dirname, args.output, series_io.subfolder(file_path))
         if not os.path.exists(output_dir):
             os.makedirs(output_dir, exist_ok=True)
         with open(os.path.join(output_dir, new_file_name), 'w') as f:
-            result = map(str, list(lesss.Result))
-            f.write('\n'.join(result))
+            f.write('\n'.join(map(str, result)))
+
+        if args.surrogates > 0:
+            original, values, p = surrogates.significance(
+                lambda s: max(calculate(s, used_args)[1]),
+                series, args.surrogates, args.surrogate_kind, args.seed, args.workers, original=max(result))
+
+            print(f'p-value: {p}')
+
+            surrogates_dir = os.path.join(output_dir, 'surrogates')
+            if not os.path.exists(surrogates_dir):
+                os.makedirs(surrogates_dir, exist_ok=True)
+            surrogates.write_report(os.path.join(surrogates_dir, new_file_name), original, values, p)
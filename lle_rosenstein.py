@@ -3,7 +3,6 @@ import os
 import argparse
 import math
 import numpy as np
-from pathlib import Path
 
 from pythonnet import load
 load("coreclr")
@@ -14,6 +13,14 @@ clr.AddReference("ChaosSoft")
 from ChaosSoft.NumericalMethods.Extensions import DataSeriesUtils
 from ChaosSoft.NumericalMethods.Lyapunov import LleRosenstein
 
+import adaptive
+import correlation
+import embedding
+import ensemble
+import series_io
+import shared_series
+import surrogates
+
 # Description of arguments
 #
 # -d / --e_dim            Determines how many previous states are considered to predict the next state in the phase space.
@@ -46,6 +53,75 @@ from ChaosSoft.NumericalMethods.Lyapunov import LleRosenstein
 #
 # -p / --xstop            Stop row index (exclusive) of the time series in the file. This integer specifies
 #                         the row number at which to stop reading the time series data (not inclusive).
+#
+# -H / --shared           Handle of a shared memory block holding the already parsed --file, passed by batching.py.
+#                         Rows and column are sliced out of the block instead of parsing the file again.
+#
+# =========================================================================================================
+#
+# -S / --surrogates       Number of surrogate series to test the result against. When positive, the estimator is also run
+#                         on that many surrogates of the series and the p-value is written to the 'surrogates' subfolder
+#                         of the output folder (original result, p-value, then one surrogate result per line).
+#
+# -K / --surrogate_kind   Kind of surrogates: 'ft' (phase randomised) or 'iaaft' (amplitude adjusted).
+#
+# -R / --seed             Seed of the random generator used for the surrogates.
+#
+# -W / --workers          Number of threads the original series and its surrogates are processed with.
+#
+# -T / --auto_tau         Estimates the time lag of every series instead of using --tau: 'mi' for the first minimum of
+#                         the average mutual information, 'acf' for the 1/e decay of the autocorrelation.
+#
+# -D / --auto_e_dim       Estimates the embedding dimension of every series from the false nearest neighbours
+#                         instead of using --e_dim.
+#
+# -L / --max_lag          Largest time lag considered by --auto_tau.
+#
+# -M / --max_dim          Largest embedding dimension considered by --auto_e_dim.
+#
+# -G / --ensemble         Treats all the found files as short trials of the same system and estimates a single exponent
+#                         from their pooled phase space (nearest neighbours are searched across all the files, but the
+#                         trajectories never cross from one file into another). The exponent is written to
+#                         'ensemble.txt' in the output folder, followed by one line per file with its own exponent and
+#                         the number of reference points it contributed. --auto_tau/--auto_e_dim take the median of the
+#                         per-file estimates, surrogates, --shared and --adaptive are not supported.
+#
+# -C / --correlation      Number of radii of the logarithmic grid the correlation sum is counted over. When positive, the
+#                         correlation dimension is estimated as well (with the same --window) and written to the
+#                         'correlation' subfolder of the output folder (dimension, then one 'radius sum' pair per line).
+#                         The sum is counted over the reference points in the same neighbour pass as the divergence
+#                         curve, so the exponent is then computed in numpy (as with --adaptive) instead of by the .NET
+#                         estimator, whose own search cannot be shared.
+#
+# -A / --adaptive         Convergence tolerance of the adaptive mode. When given, the divergence curve is computed in
+#                         numpy from a single neighbour search and extended one iteration at a time, up to --iterations,
+#                         until its linear region has ended and the slope changes by less than the tolerance. The number
+#                         of iterations actually used is reported. Not supported in ensemble mode.
+
+
+def calculate(series, args):
+    lle = LleRosenstein(args.e_dim, args.tau,
+                        args.iterations, args.window, args.eps_min)
+    lle.Calculate(series)
+
+    leSectorEnd = DataSeriesUtils.SlopeChangePointIndex(
+        lle.Slope, 3, lle.Slope.Amplitude.Y / 30)
+
+    if (leSectorEnd <= 0):
+        leSectorEnd = lle.Slope.Length
+
+    slope = math.atan2(lle.Slope.DataPoints[leSectorEnd - 1].Y - lle.Slope.DataPoints[0].Y,
+                       lle.Slope.DataPoints[leSectorEnd - 1].X - lle.Slope.DataPoints[0].X)
+
+    return lle, slope
+
+
+def divergence(series, args, tol=None, correlation_radii=0):
+    curve, correlation_sum = adaptive.divergence(series, args.e_dim, args.tau, args.iterations, tol,
+                                                 args.window, args.eps_min, correlation_radii)
+
+    return curve, ensemble.slope(curve), correlation_sum
+
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(
@@ -114,6 +190,67 @@ if __name__ == '__main__':
         type=int, help='Stop row index (exclusive) of the time series in the file',
         default=None
     )
+    parser.add_argument(
+        '-H', '--shared',
+        type=str, help='Shared memory handle of the parsed time series file',
+        default=None
+    )
+
+    parser.add_argument(
+        '-S', '--surrogates',
+        type=int, help='Number of surrogates for significance testing',
+        default=0
+    )
+    parser.add_argument(
+        '-K', '--surrogate_kind',
+        type=str, help='Kind of surrogates',
+        choices=surrogates.KINDS, default='iaaft'
+    )
+    parser.add_argument(
+        '-R', '--seed',
+        type=int, help='Seed for surrogate generation',
+        default=None
+    )
+    parser.add_argument(
+        '-W', '--workers',
+        type=int, help='Number of threads for surrogate testing',
+        default=None
+    )
+
+    parser.add_argument(
+        '-T', '--auto_tau',
+        type=str, help='Method for estimating the time lag',
+        choices=embedding.TAU_METHODS, default=None
+    )
+    parser.add_argument(
+        '-D', '--auto_e_dim',
+        action='store_true', help='Estimate the embedding dimension'
+    )
+    parser.add_argument(
+        '-L', '--max_lag',
+        type=int, help='Largest time lag for estimation',
+        default=100
+    )
+    parser.add_argument(
+        '-M', '--max_dim',
+        type=int, help='Largest embedding dimension for estimation',
+        default=10
+    )
+
+    parser.add_argument(
+        '-G', '--ensemble',
+        action='store_true', help='Estimate a single exponent from all the files'
+    )
+    parser.add_argument(
+        '-C', '--correlation',
+        type=int, help='Number of radii for the correlation sum',
+        default=0
+    )
+    parser.add_argument(
+        '-A', '--adaptive',
+        type=float, help='Convergence tolerance for adaptive iterations',
+        default=None
+    )
 
     args = parser.parse_args()
 
@@ -124,12 +261,12 @@ if __name__ == '__main__':
     file, extension, folder = args.file, args.extension, args.folder
     start, stop = args.xstart, args.xstop
     if folder and os.path.exists(folder):
-        if file and os.path.exists(file_path := os.path.join(folder, file)):
-            if os.path.isfile(file_path):
+        if file and series_io.isfile(file_path := os.path.join(folder, file)):
+            if series_io.isfile(file_path):
                 if not extension:
                     file_paths.append(file_path)
                 else:
-                    if Path(file_path).suffix == extension:
+                    if series_io.matches(file_path, extension):
                         file_paths.append(file_path)
         else:
             for file_entry in os.scandir(folder):
@@ -138,46 +275,120 @@ if __name__ == '__main__':
                     if not extension:
                         file_paths.append(file_path)
                     else:
-                        if Path(file_path).suffix == extension:
+                        if series_io.matches(file_path, extension):
                             file_paths.append(file_path)
     else:
-        if file and os.path.exists(file) and os.path.isfile(file):
+        if file and series_io.isfile(file):
             if not extension:
                 file_paths.append(file)
             else:
-                if Path(file).suffix == extension:
+                if series_io.matches(file, extension):
                     file_paths.append(file)
 
+    file_paths = series_io.expand(file_paths, extension)
+
     if len(file_paths) == 0:
         raise Exception('No file found!')
 
-    for file_path in file_paths:
-        data = np.loadtxt(file_path)
-        start = args.xstart
-        stop = args.xstop
-        series = data[start:stop, args.column]
-
-        lle = LleRosenstein(args.e_dim, args.tau,
-                            args.iterations, args.window, args.eps_min)
-        lle.Calculate(series)
+    if args.ensemble and (args.surrogates > 0 or args.shared or args.adaptive is not None):
+        raise Exception('Ensemble mode does not support surrogates, a shared series or the adaptive mode!')
 
-        leSectorEnd = DataSeriesUtils.SlopeChangePointIndex(
-            lle.Slope, 3, lle.Slope.Amplitude.Y / 30)
+    if args.ensemble:
+        loaded = list(series_io.iterate(file_paths, args.column, args.xstart, args.xstop, extension))
+        if len(loaded) == 0:
+            raise Exception('No file found!')
+        file_paths, series_list = zip(*loaded)
 
-        if (leSectorEnd <= 0):
-            leSectorEnd = lle.Slope.Length
+        if args.auto_tau or args.auto_e_dim:
+            # One embedding for the whole group, from the median of the per-file estimates
+            estimates = [embedding.estimate(series, args.tau, args.e_dim, args.auto_tau, args.auto_e_dim,
+                                            args.max_lag, args.max_dim, args.window) for series in series_list]
+            args.tau, args.e_dim = (int(np.median(values)) for values in zip(*estimates))
+            print(f'tau: {args.tau}, e_dim: {args.e_dim}')
 
-        slope = math.atan2(lle.Slope.DataPoints[leSectorEnd - 1].Y - lle.Slope.DataPoints[0].Y,
-                           lle.Slope.DataPoints[leSectorEnd - 1].X - lle.Slope.DataPoints[0].X)
+        curve, contributions, correlation_sum = ensemble.divergence(series_list, args.e_dim, args.tau,
+                                                                    args.iterations, args.window, args.eps_min,
+                                                                    args.correlation)
+        slope = ensemble.slope(curve)
 
-        print(lle.ToString())
         print(slope)
 
-        stem = Path(file_path).stem
-        dirname = os.path.dirname(file_path)
-        new_file_name = f'{stem}.txt'
-        output_dir = os.path.join(dirname, args.output)
+        output_dir = os.path.join(series_io.dirname(file_paths[0]), args.output)
         if not os.path.exists(output_dir):
             os.makedirs(output_dir, exist_ok=True)
-        with open(os.path.join(output_dir, new_file_name), 'w') as f:
+        with open(os.path.join(output_dir, 'ensemble.txt'), 'w') as f:
             f.write(f'{slope}')
+            for file_path, (file_curve, count) in zip(file_paths, contributions):
+                file_slope = ensemble.slope(file_curve) if file_curve is not None else float('nan')
+                label = os.path.join(series_io.subfolder(file_path), series_io.stem(file_path))
+                f.write(f'\n{label} {file_slope} {count}')
+
+        if correlation_sum is not None:
+            grid, sums = correlation_sum
+            dimension = correlation.dimension(grid, sums)
+
+            print(f'correlation dimension: {dimension}')
+
+            correlation_dir = os.path.join(output_dir, 'correlation')
+            if not os.path.exists(correlation_dir):
+                os.makedirs(correlation_dir, exist_ok=True)
+            correlation.write_report(os.path.join(correlation_dir, 'ensemble.txt'), dimension, grid, sums)
+    else:
+        if args.shared:
+            shm, data = shared_series.attach(args.shared)
+            loaded = ((file_path, data[args.xstart:args.xstop, args.column]) for file_path in file_paths)
+        else:
+            loaded = series_io.iterate(file_paths, args.column, args.xstart, args.xstop, extension)
+
+        for file_path, series in loaded:
+            if args.auto_tau or args.auto_e_dim:
+                args.tau, args.e_dim = embedding.estimate(series, args.tau, args.e_dim, args.auto_tau, args.auto_e_dim,
+                                                          args.max_lag, args.max_dim, args.window)
+                print(f'tau: {args.tau}, e_dim: {args.e_dim}')
+
+            if args.adaptive is not None or args.correlation > 0:
+                curve, slope, correlation_sum = divergence(series, args, args.adaptive, args.correlation)
+                iterations = curve.shape[0] - 1
+                estimator = lambda s: divergence(s, adaptive.with_iterations(args, iterations))[1]
+
+                if args.adaptive is not None:
+                    print(f'iterations: {iterations}')
+            else:
+                lle, slope = calculate(series, args)
+                correlation_sum = None
+                estimator = lambda s: calculate(s, args)[1]
+
+                print(lle.ToString())
+            print(slope)
+
+            stem = series_io.stem(file_path)
+            dirname = series_io.dirname(file_path)
+            new_file_name = f'{stem}.txt'
+            output_dir = os.path.join(dirname, args.output, series_io.subfolder(file_path))
+            if not os.path.exists(output_dir):
+                os.makedirs(output_dir, exist_ok=True)
+            with open(os.path.join(output_dir, new_file_name), 'w') as f:
+                f.write(f'{slope}')
+
+            if correlation_sum is not None:
+                grid, sums = correlation_sum
+                dimension = correlation.dimension(grid, sums)
+
+                print(f'correlation dimension: {dimension}')
+
+                correlation_dir = os.path.join(output_dir, 'correlation')
+                if not os.path.exists(correlation_dir):
+                    os.makedirs(correlation_dir, exist_ok=True)
+                correlation.write_report(os.path.join(correlation_dir, new_file_name), dimension, grid, sums)
+
+            if args.surrogates > 0:
+                original, values, p = surrogates.significance(
+                    estimator,
+                    series, args.surrogates, args.surrogate_kind, args.seed, args.workers, original=slope)
+
+                print(f'p-value: {p}')
+
+                surrogates_dir = os.path.join(output_dir, 'surrogates')
+                if not os.path.exists(surrogates_dir):
+                    os.makedirs(surrogates_dir, exist_ok=True)
+                surrogates.write_report(os.path.join(surrogates_dir, new_file_name), original, values, p)
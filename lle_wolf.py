@@ -1,7 +1,5 @@
 import os
 import argparse
-import numpy as np
-from pathlib import Path
 
 from pythonnet import load
 load("coreclr")
@@ -11,6 +9,11 @@ import clr
 clr.AddReference("ChaosSoft")
 from ChaosSoft.NumericalMethods.Lyapunov import LleWolf
 
+import embedding
+import series_io
+import shared_series
+import surrogates
+
 # Description of arguments
 #
 # -d / --e_dim            Determines the number of dimensions in the reconstructed phase space, 
@@ -50,6 +53,39 @@ from ChaosSoft.NumericalMethods.Lyapunov import LleWolf
 #                         
 # -p / --xstop            Stop row index (exclusive) of the time series in the file. This integer specifies 
 #                         the row number at which to stop reading the time series data (not inclusive).
+#
+# -H / --shared           Handle of a shared memory block holding the already parsed --file, passed by batching.py.
+#                         Rows and column are sliced out of the block instead of parsing the file again.
+#
+# =========================================================================================================
+#
+# -S / --surrogates       Number of surrogate series to test the result against. When positive, the estimator is also run
+#                         on that many surrogates of the series and the p-value is written to the 'surrogates' subfolder
+#                         of the output folder (original result, p-value, then one surrogate result per line).
+#
+# -K / --surrogate_kind   Kind of surrogates: 'ft' (phase randomised) or 'iaaft' (amplitude adjusted).
+#
+# -R / --seed             Seed of the random generator used for the surrogates.
+#
+# -W / --workers          Number of threads the original series and its surrogates are processed with.
+#
+# -T / --auto_tau         Estimates the time lag of every series instead of using --tau: 'mi' for the first minimum of
+#                         the average mutual information, 'acf' for the 1/e decay of the autocorrelation.
+#
+# -D / --auto_e_dim       Estimates the embedding dimension of every series from the false nearest neighbours
+#                         instead of using --e_dim.
+#
+# -L / --max_lag          Largest time lag considered by --auto_tau.
+#
+# -M / --max_dim          Largest embedding dimension considered by --auto_e_dim.
+
+
+def calculate(series, args):
+    lle = LleWolf(args.e_dim, args.tau, args.dt, args.eps_min, args.eps_max, args.evolv)
+    lle.Calculate(series)
+
+    return lle, float(lle.Result)
+
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(
@@ -130,6 +166,52 @@ if __name__ == '__main__':
       type=int, help='Stop row index (exclusive) of the time series in the file', 
       default=None
     )
+    parser.add_argument(
+      '-H', '--shared', 
+      type=str, help='Shared memory handle of the parsed time series file', 
+      default=None
+    )
+
+    parser.add_argument(
+      '-S', '--surrogates', 
+      type=int, help='Number of surrogates for significance testing', 
+      default=0
+    )
+    parser.add_argument(
+      '-K', '--surrogate_kind', 
+      type=str, help='Kind of surrogates', 
+      choices=surrogates.KINDS, default='iaaft'
+    )
+    parser.add_argument(
+      '-R', '--seed', 
+      type=int, help='Seed for surrogate generation', 
+      default=None
+    )
+    parser.add_argument(
+      '-W', '--workers', 
+      type=int, help='Number of threads for surrogate testing', 
+      default=None
+    )
+
+    parser.add_argument(
+      '-T', '--auto_tau', 
+      type=str, help='Method for estimating the time lag', 
+      choices=embedding.TAU_METHODS, default=None
+    )
+    parser.add_argument(
+      '-D', '--auto_e_dim', 
+      action='store_true', help='Estimate the embedding dimension'
+    )
+    parser.add_argument(
+      '-L', '--max_lag', 
+      type=int, help='Largest time lag for estimation', 
+      default=100
+    )
+    parser.add_argument(
+      '-M', '--max_dim', 
+      type=int, help='Largest embedding dimension for estimation', 
+      default=10
+    )
 
     args = parser.parse_args()
 
@@ -140,12 +222,12 @@ if __name__ == '__main__':
     file, extension, folder = args.file, args.extension, args.folder
     start, stop = args.xstart, args.xstop
     if folder and os.path.exists(folder):
-        if file and os.path.exists(file_path := os.path.join(folder, file)):
-            if os.path.isfile(file_path):
+        if file and series_io.isfile(file_path := os.path.join(folder, file)):
+            if series_io.isfile(file_path):
                 if not extension:
                     file_paths.append(file_path)
                 else:
-                    if Path(file_path).suffix == extension:
+                    if series_io.matches(file_path, extension):
                         file_paths.append(file_path)
         else:
             for file_entry in os.scandir(folder):
@@ -154,37 +236,55 @@ if __name__ == '__main__':
                     if not extension:
                         file_paths.append(file_path)
                     else:
-                        if Path(file_path).suffix == extension:
+                        if series_io.matches(file_path, extension):
                             file_paths.append(file_path)
     else:
-        if file and os.path.exists(file) and os.path.isfile(file):
+        if file and series_io.isfile(file):
             if not extension:
                 file_paths.append(file)
             else:
-                if Path(file).suffix == extension:
+                if series_io.matches(file, extension):
                     file_paths.append(file)
 
+    file_paths = series_io.expand(file_paths, extension)
+
     if len(file_paths) == 0:
         raise Exception('No file found!')
 
-    for file_path in file_paths:
-      data = np.loadtxt(file_path)
-      start = args.xstart
-      stop = args.xstop
-      series = data[start:stop, args.column]
+    if args.shared:
+        shm, data = shared_series.attach(args.shared)
+        loaded = ((file_path, data[args.xstart:args.xstop, args.column]) for file_path in file_paths)
+    else:
+        loaded = series_io.iterate(file_paths, args.column, args.xstart, args.xstop, extension)
+
+    for file_path, series in loaded:
+      if args.auto_tau or args.auto_e_dim:
+          args.tau, args.e_dim = embedding.estimate(series, args.tau, args.e_dim, args.auto_tau, args.auto_e_dim,
+                                                    args.max_lag, args.max_dim, 0)
+          print(f'tau: {args.tau}, e_dim: {args.e_dim}')
 
-      lle = LleWolf(args.e_dim, args.tau, args.dt, args.eps_min, args.eps_max, args.evolv)
-      lle.Calculate(series)
+      lle, result = calculate(series, args)
 
       print(lle.ToString())
       print(lle.GetResultAsString())
 
-      stem = Path(file_path).stem
-      dirname = os.path.dirname(file_path)
+      stem = series_io.stem(file_path)
+      dirname = series_io.dirname(file_path)
       new_file_name = f'{stem}.txt'
-      output_dir = os.path.join(dirname, args.output)
+      output_dir = os.path.join(dirname, args.output, series_io.subfolder(file_path))
       if not os.path.exists(output_dir):
           os.makedirs(output_dir, exist_ok=True)
       with open(os.path.join(output_dir, new_file_name), 'w') as f:
-          result = float(lle.Result)
           f.write(f'{result}')
+
+      if args.surrogates > 0:
+          original, values, p = surrogates.significance(
+              lambda s: calculate(s, args)[1], series, args.surrogates,
+              args.surrogate_kind, args.seed, args.workers, original=result)
+
+          print(f'p-value: {p}')
+
+          surrogates_dir = os.path.join(output_dir, 'surrogates')
+          if not os.path.exists(surrogates_dir):
+              os.makedirs(surrogates_dir, exist_ok=True)
+          surrogates.write_report(os.path.join(surrogates_dir, new_file_name), original, values, p)
@@ -0,0 +1,151 @@
+import os
+import json
+import contextlib
+import time
+import threading
+from collections import Counter, defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Progress and throughput of a batching run
+#
+# Snapshot is a JSON object with the files done, failed and remaining, the jobs in flight, the queue depth of the
+# batcher (jobs not submitted yet), the throughput and mean duration of every batched script, the utilisation of
+# every worker thread (share of the run it spent busy) and an ETA extrapolated from the rate of successful jobs.
+# A job fails when its worker exits with a nonzero code (or cannot be started), failed jobs are reported apart and
+# do not count towards the throughput. A file is done once all its jobs succeeded, failed once all its jobs
+# finished and one of them failed. The snapshot can be served on a local HTTP port and/or rewritten to a file
+# periodically, the file is replaced atomically so that readers never see it half written. A failed periodic write is
+# reported and retried at the next interval.
+
+
+class Metrics:
+    def __init__(self, jobs, queue_depth):
+        self.queue_depth = queue_depth
+        self.started = time.time()
+        self.lock = threading.Lock()
+
+        self.jobs_total = len(jobs)
+        self.pending = Counter(file_name for file_name, _, _ in jobs)
+        self.files_total = len(self.pending)
+        self.files_done = 0
+        self.files_failed = 0
+        self.failed = set()
+        self.jobs_done = 0
+        self.jobs_failed = 0
+        self.in_flight = {}
+        self.write_lock = threading.Lock()
+
+        self.method_done = Counter()
+        self.method_failed = Counter()
+        self.method_busy = defaultdict(float)
+        self.worker_busy = defaultdict(float)
+
+    def start(self, file_name, what):
+        worker = threading.current_thread().name
+        with self.lock:
+            self.in_flight[worker] = (file_name, what, time.time())
+
+    def finish(self, returncode=None):
+        worker = threading.current_thread().name
+        with self.lock:
+            file_name, what, started = self.in_flight.pop(worker)
+            duration = time.time() - started
+            self.worker_busy[worker] += duration
+
+            if returncode == 0:
+                self.jobs_done += 1
+                self.method_done[what] += 1
+                self.method_busy[what] += duration
+            else:
+                self.jobs_failed += 1
+                self.method_failed[what] += 1
+                self.failed.add(file_name)
+
+            self.pending[file_name] -= 1
+            if self.pending[file_name] == 0:
+                if file_name in self.failed:
+                    self.files_failed += 1
+                else:
+                    self.files_done += 1
+
+    def snapshot(self):
+        with self.lock:
+            now = time.time()
+            elapsed = max(now - self.started, 1e-9)
+            rate = self.jobs_done / elapsed
+            remaining = self.jobs_total - self.jobs_done - self.jobs_failed
+
+            # Jobs still running count towards the utilisation of their worker
+            worker_busy = dict(self.worker_busy)
+            for worker, (_, _, started) in self.in_flight.items():
+                worker_busy[worker] = worker_busy.get(worker, 0.0) + now - started
+
+            return {
+                'elapsed': elapsed,
+                'files_done': self.files_done,
+                'files_failed': self.files_failed,
+                'files_remaining': self.files_total - self.files_done - self.files_failed,
+                'jobs_done': self.jobs_done,
+                'jobs_failed': self.jobs_failed,
+                'jobs_remaining': remaining,
+                'queue_depth': self.queue_depth(),
+                'in_flight': [
+                    {'worker': worker, 'file': file_name, 'what': what, 'running': now - started}
+                    for worker, (file_name, what, started) in self.in_flight.items()
+                ],
+                'methods': {
+                    what: {
+                        'done': self.method_done[what],
+                        'failed': self.method_failed[what],
+                        'per_second': self.method_done[what] / elapsed,
+                        'mean_seconds': self.method_busy[what] / self.method_done[what]
+                        if self.method_done[what] else None,
+                    }
+                    for what in self.method_done.keys() | self.method_failed.keys()
+                },
+                'workers': {worker: busy / elapsed for worker, busy in worker_busy.items()},
+                'jobs_per_second': rate,
+                'eta': remaining / rate if rate > 0 else None,
+            }
+
+    def serve(self, port):
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = json.dumps(metrics.snapshot()).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+    def write(self, path):
+        with self.write_lock:
+            try:
+                with open(f'{path}.tmp', 'w') as f:
+                    json.dump(self.snapshot(), f, indent=2)
+                os.replace(f'{path}.tmp', path)
+            except Exception:
+                with contextlib.suppress(OSError):
+                    os.remove(f'{path}.tmp')
+                raise
+
+    def watch(self, path, interval=1.0):
+        def _watch():
+            while True:
+                # Replacing fails on Windows while a reader holds the file open, the next interval tries again
+                try:
+                    self.write(path)
+                except Exception as e:
+                    print(f'Could not write the metrics to {path}: {e}')
+                time.sleep(interval)
+
+        threading.Thread(target=_watch, daemon=True).start()
@@ -0,0 +1,66 @@
+import numpy as np
+
+# Brute force neighbour search over a reconstructed phase space
+#
+# Pairwise distances are produced in blocks of rows, so that memory stays bounded for long series. Every point
+# carries the index of the series it belongs to (group) and its time index within that series, pairs closer in
+# time than the Theiler window are excluded only when both points come from the same series.
+
+# Upper bound of the pairwise distance block held in memory at once (number of floats)
+BLOCK_SIZE = 1 << 22
+
+
+def chunks(count):
+    # Rows of the pairwise distance blocks, so that a block stays below BLOCK_SIZE floats
+    chunk = max(1, BLOCK_SIZE // count)
+    for start in range(0, count, chunk):
+        yield start, min(start + chunk, count)
+
+
+def excluded(start, stop, groups, indices, window):
+    return (groups[start:stop, None] == groups[None, :]) & \
+        (np.abs(indices[start:stop, None] - indices[None, :]) <= window)
+
+
+def distance_blocks(points, groups=None, indices=None, window=0):
+    count = points.shape[0]
+    if groups is None:
+        groups = np.zeros(count, dtype=np.int64)
+    if indices is None:
+        indices = np.arange(count)
+
+    for start, stop in chunks(count):
+        distances = np.zeros((stop - start, count))
+        for k in range(points.shape[1]):
+            distances += (points[start:stop, k, None] - points[None, :, k]) ** 2
+        np.sqrt(distances, out=distances)
+
+        distances[excluded(start, stop, groups, indices, window)] = np.inf
+
+        yield start, stop, distances
+
+
+def count_pairs(distances, radii):
+    # Pairs per interval between consecutive radii, cumulated they give the number of pairs closer than each radius
+    finite = distances[np.isfinite(distances)]
+    bins = np.searchsorted(radii, finite, side='right')
+    return np.bincount(bins, minlength=radii.shape[0] + 1), finite.shape[0]
+
+
+def search(points, groups=None, indices=None, window=0, eps_min=0.0, radii=None):
+    # Nearest neighbours and, when radii are given, the correlation sum over them in the same pass
+    neighbours = np.empty(points.shape[0], dtype=np.int64)
+    distance = np.empty(points.shape[0])
+    counts, pairs = 0, 0
+
+    for start, stop, distances in distance_blocks(points, groups, indices, window):
+        if radii is not None:
+            block_counts, block_pairs = count_pairs(distances, radii)
+            counts, pairs = counts + block_counts, pairs + block_pairs
+
+        distances[distances <= eps_min] = np.inf
+        neighbours[start:stop] = np.argmin(distances, axis=1)
+        distance[start:stop] = distances[np.arange(stop - start), neighbours[start:stop]]
+
+    sums = np.cumsum(counts)[:-1] / max(pairs, 1) if radii is not None else None
+    return neighbours, distance, sums
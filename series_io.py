@@ -0,0 +1,200 @@
+import io
+import os
+import bz2
+import gzip
+import lzma
+import tarfile
+import zipfile
+import itertools
+import contextlib
+import numpy as np
+from pathlib import Path, PurePosixPath
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Reading time series files which are compressed and/or bundled in archives
+#
+# Compressed files (.gz, .bz2, .xz, .zst) are decoded while they are read, nothing is written to disk. Members of
+# .zip and .tar archives (also .tar.gz, .tgz, .tar.bz2, .tar.xz) are addressed as '<archive>::<member>' and read
+# straight out of the archive, members may be compressed themselves. Only the rows up to the stop row are decoded
+# and only the requested column is parsed. Reading .zst needs the zstandard package.
+#
+# Members of a (compressed) tar archive are not random-access: reaching one means decoding every member stored
+# before it. They are therefore never listed up front (expand leaves tar archives whole) and are read in a single
+# streaming pass over the archive (iterate), in the order they are stored, filtered by extension on the way. A tar
+# archive should be handed to one process as a whole rather than one process per member.
+#
+# Outputs of a series are named so that no two inputs share them: a compressed file keeps its whole name (x.txt.gz
+# next to x.txt), and the outputs of an archive member go to a subfolder named after the archive, followed by the
+# folders of the member within it (a.zip/sub/ for a.zip::sub/x.txt).
+
+SEPARATOR = '::'
+COMPRESSIONS = ('.gz', '.bz2', '.xz', '.zst')
+ARCHIVES = ('.zip', '.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tar.xz')
+
+
+def split(path):
+    archive, _, member = path.partition(SEPARATOR)
+    return archive, member or None
+
+
+def is_archive(path):
+    return path.lower().endswith(ARCHIVES)
+
+
+def is_tar(path):
+    return is_archive(path) and not path.lower().endswith('.zip')
+
+
+def name(path):
+    # Name of the series itself, without the archive and the compression suffix
+    archive, member = split(path)
+    file_name = Path(member or archive).name
+    for suffix in COMPRESSIONS:
+        if file_name.lower().endswith(suffix):
+            return file_name[:-len(suffix)]
+    return file_name
+
+
+def stem(path):
+    archive, member = split(path)
+    file_name = PurePosixPath(member or archive).name
+    if file_name.lower().endswith(COMPRESSIONS):
+        return file_name
+    return Path(file_name).stem
+
+
+def dirname(path):
+    # Outputs of archive members go next to the archive, in their subfolder
+    return os.path.dirname(split(path)[0])
+
+
+def subfolder(path):
+    archive, member = split(path)
+    if member is None:
+        return ''
+
+    folders = [part for part in PurePosixPath(member).parent.parts if part not in ('/', '.', '..')]
+    return os.path.join(Path(archive).name, *folders)
+
+
+def isfile(path):
+    archive, _ = split(path)
+    return os.path.isfile(archive)
+
+
+def matches(path, extension):
+    if not extension or is_archive(path):
+        return True
+    return Path(name(path)).suffix == extension
+
+
+def members(path, extension=None):
+    # Zip archives only, their index is read without decoding the members
+    with zipfile.ZipFile(path) as archive:
+        names = [info.filename for info in archive.infolist() if not info.is_dir()]
+
+    return [f'{path}{SEPARATOR}{member}' for member in names if matches(member, extension)]
+
+
+def expand(paths, extension=None):
+    expanded = []
+    for path in paths:
+        if is_archive(path) and not is_tar(path) and split(path)[1] is None:
+            expanded.extend(members(path, extension))
+        else:
+            expanded.append(path)
+
+    return expanded
+
+
+def decompress(stream, path):
+    lower = path.lower()
+    if lower.endswith('.gz'):
+        return gzip.GzipFile(fileobj=stream)
+    if lower.endswith('.bz2'):
+        return bz2.BZ2File(stream)
+    if lower.endswith('.xz'):
+        return lzma.LZMAFile(stream)
+    if lower.endswith('.zst'):
+        if zstandard is None:
+            raise Exception('Install zstandard to read .zst files!')
+        # Reader is not line iterable on its own
+        return io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(stream))
+
+    return stream
+
+
+@contextlib.contextmanager
+def open_binary(path):
+    with contextlib.ExitStack() as stack:
+        archive_path, member = split(path)
+        if member is None:
+            stream = stack.enter_context(open(archive_path, 'rb'))
+        elif archive_path.lower().endswith('.zip'):
+            archive = stack.enter_context(zipfile.ZipFile(archive_path))
+            stream = stack.enter_context(archive.open(member))
+        else:
+            # Streaming mode stops at the member instead of indexing (and decoding) the whole archive first
+            archive = stack.enter_context(tarfile.open(archive_path, 'r|*'))
+            info = next((info for info in archive if info.name == member), None)
+            if info is None:
+                raise Exception(f'No {member} in {archive_path}!')
+            stream = stack.enter_context(archive.extractfile(info))
+
+        yield stack.enter_context(decompress(stream, member or archive_path))
+
+
+def rows(stream):
+    # Same rows np.loadtxt keeps, so that row indices mean the same as before. Lines are decoded one by one,
+    # text wrappers need seekable streams which streamed tar members are not
+    for line in stream:
+        line = line.decode()
+        stripped = line.strip()
+        if stripped and not stripped.startswith('#'):
+            yield line
+
+
+def parse(stream, column, start=None, stop=None):
+    if (start is None or start >= 0) and (stop is None or stop >= 0):
+        # Decoding stops right after the last requested row
+        return np.loadtxt(itertools.islice(rows(stream), start, stop), usecols=column, ndmin=1)
+
+    return np.loadtxt(rows(stream), usecols=column, ndmin=1)[start:stop]
+
+
+def load(path, column, start=None, stop=None):
+    with open_binary(path) as stream:
+        return parse(stream, column, start, stop)
+
+
+def iterate(paths, column, start=None, stop=None, extension=None):
+    # Yields (path, series), tar members come last, archive by archive, in the order they are stored. A whole tar
+    # archive yields its members which match the extension, explicit members are picked up on the way
+    tar_members = {}
+    for path in paths:
+        archive_path, member = split(path)
+        if is_tar(archive_path):
+            tar_members.setdefault(archive_path, set()).add(member)
+        else:
+            yield path, load(path, column, start, stop)
+
+    for archive_path, wanted in tar_members.items():
+        with tarfile.open(archive_path, 'r|*') as archive:
+            for info in archive:
+                if not info.isfile():
+                    continue
+                if info.name not in wanted and (None not in wanted or not matches(info.name, extension)):
+                    continue
+
+                with decompress(archive.extractfile(info), info.name) as stream:
+                    series = parse(stream, column, start, stop)
+                yield f'{archive_path}{SEPARATOR}{info.name}', series
+
+
+def load_table(path):
+    with open_binary(path) as stream:
+        return np.loadtxt(rows(stream), ndmin=2)
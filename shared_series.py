@@ -0,0 +1,44 @@
+import os
+import numpy as np
+from multiprocessing import shared_memory, resource_tracker
+
+import series_io
+
+# Handing a loaded time series file from the batching process over to its workers
+#
+# The parent parses the file once into a shared memory block and passes the workers only its handle
+# ('<name>:<rows>:<columns>'). Workers map the block and slice the rows and the column they need out of it
+# without copying.
+
+
+def share(data):
+    data = np.asarray(data, dtype=float)
+    if data.ndim == 1:
+        data = data[:, None]
+
+    shm = shared_memory.SharedMemory(create=True, size=max(1, data.nbytes))
+    view = np.ndarray(data.shape, dtype=float, buffer=shm.buf)
+    view[:] = data
+
+    rows, columns = data.shape
+    return shm, f'{shm.name}:{rows}:{columns}'
+
+
+def load(file_name):
+    return share(series_io.load_table(file_name))
+
+
+def attach(handle):
+    name, rows, columns = handle.split(':')
+    shm = shared_memory.SharedMemory(name=name)
+
+    # Block is owned by the parent, the worker's resource tracker must not unlink it when the worker exits
+    if os.name == 'posix':
+        resource_tracker.unregister(shm._name, 'shared_memory')
+
+    return shm, np.ndarray((int(rows), int(columns)), dtype=float, buffer=shm.buf)
+
+
+def release(shm):
+    shm.close()
+    shm.unlink()
@@ -0,0 +1,91 @@
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+
+# Surrogate data generation and significance testing
+#
+# Surrogates are generated in memory, all of them at once: the FFTs of the whole batch are computed
+# along the rows of a single (count, length) array instead of one series at a time.
+#
+# ft                      Phase randomised (Fourier transform) surrogates. Preserve the power spectrum
+#                         (linear correlations) of the series, but not its amplitude distribution.
+#
+# iaaft                   Iterative amplitude adjusted Fourier transform surrogates. Preserve both the
+#                         amplitude distribution and (approximately) the power spectrum of the series.
+
+KINDS = ('ft', 'iaaft')
+
+
+def phase_randomized(series, count, rng=None):
+    rng = np.random.default_rng(rng)
+    series = np.asarray(series, dtype=float)
+    length = series.shape[0]
+    mean = series.mean()
+
+    amplitudes = np.abs(np.fft.rfft(series - mean))
+    phases = rng.uniform(0.0, 2.0 * np.pi, size=(count, amplitudes.shape[0]))
+    # DC and Nyquist components have to stay real for the inverse transform to be real
+    phases[:, 0] = 0.0
+    if length % 2 == 0:
+        phases[:, -1] = 0.0
+
+    return np.fft.irfft(amplitudes * np.exp(1j * phases), n=length, axis=1) + mean
+
+
+def iaaft(series, count, iterations=100, rng=None):
+    rng = np.random.default_rng(rng)
+    series = np.asarray(series, dtype=float)
+    length = series.shape[0]
+
+    amplitudes = np.abs(np.fft.rfft(series))
+    sorted_values = np.sort(series)
+
+    surrogates = rng.permuted(np.tile(series, (count, 1)), axis=1)
+    ranks = None
+    for _ in range(iterations):
+        spectrum = np.fft.rfft(surrogates, axis=1)
+        surrogates = np.fft.irfft(amplitudes * np.exp(1j * np.angle(spectrum)), n=length, axis=1)
+
+        previous_ranks = ranks
+        ranks = np.argsort(np.argsort(surrogates, axis=1), axis=1)
+        surrogates = sorted_values[ranks]
+
+        # Rank ordering no longer changes, so neither will the surrogates
+        if previous_ranks is not None and np.array_equal(ranks, previous_ranks):
+            break
+
+    return surrogates
+
+
+def generate(kind, series, count, rng=None):
+    if kind == 'ft':
+        return phase_randomized(series, count, rng)
+    if kind == 'iaaft':
+        return iaaft(series, count, rng=rng)
+
+    raise Exception(f'Unknown surrogate kind: {kind}!')
+
+
+def p_value(original, values):
+    # One-sided rank test: fraction of surrogates scoring at least as high as the original series
+    values = np.asarray(values, dtype=float)
+    return (1 + np.count_nonzero(values >= original)) / (values.shape[0] + 1)
+
+
+def significance(estimate, series, count, kind='iaaft', rng=None, workers=None, original=None):
+    surrogate_series = generate(kind, series, count, rng)
+    batch = list(surrogate_series) if original is not None else [series, *surrogate_series]
+
+    # Estimators run in .NET and release the GIL, so threads are enough to keep all cores busy
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        values = list(executor.map(estimate, batch))
+
+    if original is None:
+        original, values = values[0], values[1:]
+
+    return original, values, p_value(original, values)
+
+
+def write_report(path, original, values, p):
+    with open(path, 'w') as f:
+        f.write(f'{original}\n{p}\n')
+        f.write('\n'.join(map(str, values)))